@@ -0,0 +1,144 @@
+"""
+Cost/weight/CO2 analytics backed by the cost_cube aggregate table.
+
+Every node contributes its own cost, weight and CO2 (times its quantity) to
+exactly one cube cell: (project, level-1 system, material). Summing a node's
+own figures over a subtree gives the same result as calculate_totals, so the
+cube can be refreshed one system at a time after a write instead of walking
+whole trees at read time.
+"""
+from sqlalchemy import select, func, case, literal
+from sqlalchemy.orm import Session, aliased
+from typing import List, Optional, Dict
+
+from app.calc import CO2_FACTORS
+from app.models import Project, NodeModel, CostCube
+
+GROUP_BY_OPTIONS = ("system", "material", "project")
+UNASSIGNED = "Unassigned"
+
+
+def get_system(node: NodeModel) -> NodeModel:
+    """Level-1 system a node belongs to (the root counts as its own system)"""
+    while node.parent is not None and node.parent.parent_pk is not None:
+        node = node.parent
+    return node
+
+
+def _aggregate_query(project_pk: int, system_pk: Optional[int] = None):
+    """Cube cells of a project (or one of its systems) computed from the nodes table"""
+    parent = aliased(NodeModel)
+    child = aliased(NodeModel)
+
+    # Seed with the root and the level-1 systems, then carry system_pk down.
+    # The root is its own system and must not pull its children in.
+    is_root = case((NodeModel.parent_pk == None, 1), else_=0)
+    seeds = select(NodeModel.pk.label("pk"), NodeModel.pk.label("system_pk"), is_root.label("is_root"))
+    seeds = seeds.outerjoin(parent, parent.pk == NodeModel.parent_pk).where(
+        NodeModel.project_pk == project_pk,
+        (NodeModel.parent_pk == None) | (parent.parent_pk == None)
+    )
+    if system_pk is not None:
+        seeds = seeds.where(NodeModel.pk == system_pk)
+    tagged = seeds.cte("tagged", recursive=True)
+    tagged = tagged.union_all(
+        select(child.pk, tagged.c.system_pk, literal(0))
+        .join(tagged, child.parent_pk == tagged.c.pk)
+        .where(tagged.c.is_root == 0)
+    )
+
+    material = func.coalesce(NodeModel.material, UNASSIGNED)
+    quantity = func.coalesce(NodeModel.quantity, 1)
+    weight = func.coalesce(NodeModel.weight, 0.0)
+    factor = case(CO2_FACTORS, value=NodeModel.material, else_=0.0) if CO2_FACTORS else literal(0.0)
+    co2 = case((NodeModel.material_calc_enabled == True, weight / 1000.0 * factor * quantity), else_=0.0)
+
+    return (
+        select(
+            tagged.c.system_pk,
+            material.label("material"),
+            func.sum(func.coalesce(NodeModel.own_cost, 0.0) * quantity).label("total_cost"),
+            func.sum(weight * quantity).label("total_weight"),
+            func.sum(co2).label("co2_footprint"),
+            func.count().label("part_count")
+        )
+        .join(NodeModel, NodeModel.pk == tagged.c.pk)
+        .group_by(tagged.c.system_pk, material)
+    )
+
+
+def _write_cells(db: Session, project_pk: int, system_pk: Optional[int] = None):
+    # Serialise refreshes of one project on its row, as history.record_change
+    # does: two concurrent delete-then-insert passes would otherwise both
+    # insert the same (project, system, material) cells
+    db.query(Project.pk).filter(Project.pk == project_pk).with_for_update().one()
+    stale = db.query(CostCube).filter(CostCube.project_pk == project_pk)
+    if system_pk is not None:
+        stale = stale.filter(CostCube.system_pk == system_pk)
+    stale.delete(synchronize_session=False)
+
+    for row in db.execute(_aggregate_query(project_pk, system_pk)).all():
+        db.add(CostCube(
+            project_pk=project_pk,
+            system_pk=row.system_pk,
+            material=row.material,
+            total_cost=row.total_cost or 0.0,
+            total_weight=row.total_weight or 0.0,
+            co2_footprint=row.co2_footprint or 0.0,
+            part_count=row.part_count
+        ))
+    db.commit()
+
+
+def refresh_project(db: Session, project_pk: int):
+    """Rebuild every cube cell of a project"""
+    _write_cells(db, project_pk)
+
+
+def refresh_system(db: Session, project_pk: int, system_pk: int):
+    """Rebuild the cube cells of one level-1 system after a node write"""
+    _write_cells(db, project_pk, system_pk)
+
+
+def get_breakdown(db: Session, group_by: str = "system", project_pk: Optional[int] = None,
+                  limit: Optional[int] = None) -> List[Dict]:
+    """Cost/weight/CO2/part totals grouped by system, material or project, largest cost first"""
+    total_cost = func.sum(CostCube.total_cost)
+    totals = [
+        total_cost.label("total_cost"),
+        func.sum(CostCube.total_weight).label("total_weight"),
+        func.sum(CostCube.co2_footprint).label("co2_footprint"),
+        func.sum(CostCube.part_count).label("part_count")
+    ]
+    if group_by == "system":
+        # Systems are matched by name so the portfolio view lines them up across projects
+        system = aliased(NodeModel)
+        key = [system.name.label("key")]
+        query = select(*key, *totals).select_from(CostCube).join(system, system.pk == CostCube.system_pk)
+    elif group_by == "material":
+        key = [CostCube.material.label("key")]
+        query = select(*key, *totals).select_from(CostCube)
+    else:
+        key = [Project.id.label("key"), Project.name, Project.status]
+        query = select(*key, *totals).select_from(CostCube).join(Project, Project.pk == CostCube.project_pk)
+
+    if project_pk is not None:
+        query = query.where(CostCube.project_pk == project_pk)
+    query = query.group_by(*key).order_by(total_cost.desc(), key[0])
+    if limit:
+        query = query.limit(limit)
+
+    results = []
+    for row in db.execute(query).all():
+        item = {
+            "key": row.key,
+            "total_cost": row.total_cost or 0.0,
+            "total_weight": row.total_weight or 0.0,
+            "co2_footprint": row.co2_footprint or 0.0,
+            "part_count": row.part_count or 0
+        }
+        if group_by == "project":
+            item["name"] = row.name
+            item["status"] = row.status
+        results.append(item)
+    return results
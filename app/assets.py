@@ -0,0 +1,228 @@
+"""
+Content-hashed static asset pipeline.
+
+Every file under static/ is copied to static/dist/ with a content hash in its
+name (css/styles.css -> css/styles.<hash>.css) alongside precompressed .gz
+and, when the optional `brotli` package is installed, .br variants. Raster
+images also get a .webp variant when Pillow is installed. A manifest maps
+logical paths to hashed ones; templates call asset_url() so a changed file
+gets a new URL and the old one can be cached forever.
+
+Build ahead of time with `python -m app.assets` (done in the Dockerfile and
+by docker-compose before uvicorn starts). Workers only load an existing
+manifest at startup; if it is missing or a source file changed, it is rebuilt
+on demand when a page is rendered, and only files whose hash changed are
+written.
+"""
+from fastapi import HTTPException
+from fastapi.responses import FileResponse
+from typing import Optional, Dict
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+import sys
+import threading
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+STATIC_DIR = "static"
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_PATH = os.path.join(DIST_DIR, "manifest.json")
+ASSET_URL_PREFIX = "/assets"
+STALE_CHECK_SECONDS = 2.0
+
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".html", ".txt", ".map"}
+WEBP_SOURCES = {".png", ".jpg", ".jpeg"}
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+mimetypes.add_type("image/webp", ".webp")
+
+
+def _hashed_name(rel_path: str, digest: str, ext: Optional[str] = None) -> str:
+    stem, source_ext = os.path.splitext(rel_path)
+    return f"{stem}.{digest}{ext or source_ext}".replace(os.sep, "/")
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _source_files():
+    dist = os.path.abspath(DIST_DIR)
+    for dirpath, dirnames, filenames in os.walk(STATIC_DIR):
+        dirnames[:] = sorted(d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) != dist)
+        for filename in sorted(filenames):
+            full_path = os.path.join(dirpath, filename)
+            yield os.path.relpath(full_path, STATIC_DIR).replace(os.sep, "/"), full_path
+
+
+def _build_entry(rel_path: str, full_path: str) -> Dict:
+    with open(full_path, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    stat = os.stat(full_path)
+    entry = {"hashed": _hashed_name(rel_path, digest), "mtime": stat.st_mtime, "size": stat.st_size, "variants": {}}
+
+    # Content-addressed outputs never change, so existing files are reused
+    target = os.path.join(DIST_DIR, entry["hashed"])
+    ext = os.path.splitext(rel_path)[1].lower()
+    if not os.path.exists(target):
+        _write_atomic(target, data)
+    if ext in COMPRESSIBLE:
+        if not os.path.exists(target + ".gz"):
+            _write_atomic(target + ".gz", gzip.compress(data, compresslevel=9, mtime=0))
+        if brotli is not None and not os.path.exists(target + ".br"):
+            _write_atomic(target + ".br", brotli.compress(data, quality=11))
+    if ext in WEBP_SOURCES and Image is not None:
+        webp = _hashed_name(rel_path, digest, ".webp")
+        webp_target = os.path.join(DIST_DIR, webp)
+        if not os.path.exists(webp_target):
+            tmp = f"{webp_target}.{os.getpid()}.tmp"
+            with Image.open(full_path) as img:
+                os.makedirs(os.path.dirname(webp_target), exist_ok=True)
+                img.save(tmp, format="WEBP", quality=82, method=6)
+            os.replace(tmp, webp_target)
+        entry["variants"]["webp"] = webp
+    return entry
+
+
+def build_manifest(previous: Optional[Dict] = None) -> Dict:
+    """Hash and emit every static file; unchanged sources reuse their previous entry"""
+    previous = previous or {}
+    files = {}
+    for rel_path, full_path in _source_files():
+        stat = os.stat(full_path)
+        old = previous.get(rel_path)
+        if old and old["mtime"] == stat.st_mtime and old["size"] == stat.st_size \
+                and os.path.exists(os.path.join(DIST_DIR, old["hashed"])):
+            files[rel_path] = old
+        else:
+            files[rel_path] = _build_entry(rel_path, full_path)
+    _write_atomic(MANIFEST_PATH, json.dumps(files, indent=2, sort_keys=True).encode())
+    return files
+
+
+def _is_stale(files: Dict) -> bool:
+    seen = 0
+    for rel_path, full_path in _source_files():
+        entry = files.get(rel_path)
+        if entry is None:
+            return True
+        stat = os.stat(full_path)
+        if entry["mtime"] != stat.st_mtime or entry["size"] != stat.st_size:
+            return True
+        seen += 1
+    return seen != len(files)
+
+
+class AssetManifest:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files: Optional[Dict] = None
+        self._checked_at = 0.0
+
+    def load(self) -> bool:
+        """Load a prebuilt manifest without checking or building it; False if there is none"""
+        with self._lock:
+            if self._files is None and os.path.exists(MANIFEST_PATH):
+                with open(MANIFEST_PATH) as f:
+                    self._files = json.load(f)
+                self._checked_at = time.monotonic()
+            return self._files is not None
+
+    def get(self) -> Dict:
+        """Current manifest, loaded from disk or rebuilt when sources changed"""
+        with self._lock:
+            if self._files is not None and time.monotonic() - self._checked_at < STALE_CHECK_SECONDS:
+                return self._files
+            if self._files is None and os.path.exists(MANIFEST_PATH):
+                with open(MANIFEST_PATH) as f:
+                    self._files = json.load(f)
+            if self._files is None or _is_stale(self._files):
+                self._files = build_manifest(self._files)
+            self._checked_at = time.monotonic()
+            return self._files
+
+
+manifest = AssetManifest()
+
+
+def asset_url(path: str, variant: Optional[str] = None) -> str:
+    """URL of a static file by its logical path; "" if the requested variant does not exist"""
+    entry = manifest.get().get(path.lstrip("/"))
+    if entry is None:
+        return "" if variant else f"/{STATIC_DIR}/{path.lstrip('/')}"
+    hashed = entry["variants"].get(variant) if variant else entry["hashed"]
+    return f"{ASSET_URL_PREFIX}/{hashed}" if hashed else ""
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    """Content codings of an Accept-Encoding header mapped to their q-values"""
+    accepted = {}
+    for item in accept_encoding.lower().split(","):
+        coding, *params = [part.strip() for part in item.split(";")]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def asset_response(path: str, accept_encoding: str = "") -> FileResponse:
+    """Serve a hashed asset with immutable caching and the best precompressed variant"""
+    root = os.path.abspath(DIST_DIR)
+    full_path = os.path.abspath(os.path.join(root, path))
+    if not full_path.startswith(root + os.sep) or path.endswith((".gz", ".br", ".json")) \
+            or not os.path.isfile(full_path):
+        raise HTTPException(status_code=404, detail="Asset not found")
+
+    media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    headers = {"Cache-Control": IMMUTABLE_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+    accepted = _accepted_encodings(accept_encoding)
+    candidates = []
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        # "*" covers codings the client did not list; q=0 means "never send this"
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0 and os.path.isfile(full_path + suffix):
+            candidates.append((q, encoding, suffix))
+    if candidates:
+        # Highest q wins; on a tie the earlier (smaller) encoding is kept
+        q, encoding, suffix = max(candidates, key=lambda c: c[0])
+        headers["Content-Encoding"] = encoding
+        return FileResponse(full_path + suffix, media_type=media_type, headers=headers)
+    return FileResponse(full_path, media_type=media_type, headers=headers)
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    if os.path.isdir(DIST_DIR) and "--clean" in sys.argv[1:]:
+        shutil.rmtree(DIST_DIR)
+    files = build_manifest()
+    print(f"✓ Built {len(files)} assets into {DIST_DIR} in {(time.perf_counter() - started) * 1000:.0f} ms")
+    if brotli is None:
+        print("  (brotli not installed: skipped .br variants)")
+    if Image is None:
+        print("  (Pillow not installed: skipped .webp variants)")
@@ -0,0 +1,52 @@
+from sqlalchemy.orm import Session
+from app import crud
+from app.crud import Node
+
+# MATERIAL & CO2 MASTER (Local Economics)
+MATERIAL_MASTER = {
+    "Steel (HSS)": 120.0,
+    "Aluminum 6061": 320.0,
+    "Polypropylene": 180.0,
+    "Cast Iron": 95.0,
+    "Copper": 850.0,
+    "Lithium-Ion": 1200.0,
+    "Rubber (EPDM)": 210.0,
+    "Composite": 450.0
+}
+CO2_FACTORS = {"Steel (HSS)": 2.5, "Aluminum 6061": 12.0, "Polypropylene": 1.8, "Cast Iron": 3.2, "Copper": 4.5, "Lithium-Ion": 15.0, "Rubber (EPDM)": 2.3, "Composite": 3.5}
+
+# --- CALC ENGINE ---
+
+def calculate_totals(node: Node, prefix: str = ""):
+    node.display_id = prefix
+    agg_cost = 0.0
+    agg_weight = 0.0
+    agg_co2 = 0.0
+    
+    mat_rate = MATERIAL_MASTER.get(node.material, 0.0) if node.material_calc_enabled else 0.0
+    self_part_cost = node.own_cost * node.quantity
+    
+    if node.material_calc_enabled:
+        self_co2 = (node.weight / 1000.0) * CO2_FACTORS.get(node.material, 0.0) * node.quantity
+    else:
+        self_co2 = 0.0 # or some other logic for non-metal parts
+    
+    for i, child in enumerate(node.children, 1):
+        new_prefix = f"{prefix}.{i}" if prefix else str(i)
+        res_cost, res_weight, res_co2 = calculate_totals(child, new_prefix)
+        agg_cost += res_cost
+        agg_weight += res_weight
+        agg_co2 += res_co2
+        
+    node.total_cost = self_part_cost + agg_cost
+    node.total_weight = (node.weight * node.quantity) + agg_weight
+    node.co2_footprint = self_co2 + agg_co2
+    return node.total_cost, node.total_weight, node.co2_footprint
+
+def refresh_rollups(db: Session, project_id: str) -> int:
+    """Recalculate a project's tree and persist display ids and totals; returns nodes written"""
+    tree, db_nodes = crud.load_project_tree(db, project_id)
+    if tree is None:
+        return 0
+    calculate_totals(tree)
+    return crud.save_rollups(db, tree, db_nodes)
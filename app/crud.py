@@ -1,6 +1,8 @@
+from sqlalchemy import case, func
 from sqlalchemy.orm import Session
-from typing import List, Optional, Dict
-from app.models import Project, NodeModel
+from typing import List, Optional, Dict, Tuple
+from app.models import Project, NodeModel, CostCube, NodeChange, TreeSnapshot
+from app import history
 from pydantic import BaseModel
 import time
 
@@ -65,6 +67,39 @@ def get_all_projects(db: Session) -> List[Project]:
     return db.query(Project).all()
 
 
+def get_project_summaries(db: Session) -> List[Dict]:
+    """Stored root rollups and part counts of every project that has a tree"""
+    counts = {
+        project_pk: (part_count, tracked_parts)
+        for project_pk, part_count, tracked_parts in db.query(
+            NodeModel.project_pk,
+            func.count(NodeModel.pk),
+            # A part is 'tracked' once it has a non-zero own cost
+            func.count(case((NodeModel.own_cost > 0, 1)))
+        ).group_by(NodeModel.project_pk)
+    }
+    roots = db.query(Project, NodeModel).join(NodeModel, NodeModel.project_pk == Project.pk).filter(
+        NodeModel.parent_pk == None
+    ).order_by(Project.pk, NodeModel.pk).all()
+    
+    summary = {}
+    for project, root in roots:
+        if project.pk in summary:
+            continue
+        part_count, tracked_parts = counts[project.pk]
+        summary[project.pk] = {
+            "id": project.id,
+            "name": project.name,
+            "total_cost": root.total_cost or 0.0,
+            "total_weight": root.total_weight or 0.0,
+            "config": project.config,
+            "status": project.status,
+            "part_count": part_count,
+            "tracked_parts": tracked_parts
+        }
+    return list(summary.values())
+
+
 def update_project_status(db: Session, project_id: str, status: str) -> Optional[Project]:
     """Update project status"""
     project = get_project(db, project_id)
@@ -79,18 +114,21 @@ def delete_project(db: Session, project_id: str) -> bool:
     """Delete a project and all its nodes"""
     project = get_project(db, project_id)
     if project:
+        for table in (CostCube, NodeChange, TreeSnapshot):
+            db.query(table).filter(table.project_pk == project.pk).delete(synchronize_session=False)
         db.delete(project)
         db.commit()
         return True
     return False
 
 
-def create_node(db: Session, node_data: Node, project_id: str, parent_id: Optional[str] = None) -> NodeModel:
+def create_node(db: Session, node_data: Node, project_pk: int, parent_pk: Optional[int] = None,
+                record: bool = True) -> NodeModel:
     """Create a new node in the database"""
     node = NodeModel(
         id=node_data.id,
-        project_id=project_id,
-        parent_id=parent_id,
+        project_pk=project_pk,
+        parent_pk=parent_pk,
         name=node_data.name,
         display_id=node_data.display_id,
         level=node_data.level,
@@ -106,19 +144,27 @@ def create_node(db: Session, node_data: Node, project_id: str, parent_id: Option
         co2_footprint=node_data.co2_footprint
     )
     db.add(node)
+    if record:
+        parent_id = db.query(NodeModel.id).filter(NodeModel.pk == parent_pk).scalar() if parent_pk else None
+        history.record_change(db, project_pk, "create", node.id, history.node_record(node, parent_id))
     db.commit()
     db.refresh(node)
     return node
 
 
-def save_tree_to_db(db: Session, node: Node, project_id: str, parent_id: Optional[str] = None):
+def save_tree_to_db(db: Session, node: Node, project_pk: int, parent_pk: Optional[int] = None):
     """Recursively save a tree structure to the database"""
     # Create the current node
-    db_node = create_node(db, node, project_id, parent_id)
+    db_node = create_node(db, node, project_pk, parent_pk, record=False)
     
     # Recursively save children
     for child in node.children:
-        save_tree_to_db(db, child, project_id, db_node.id)
+        save_tree_to_db(db, child, project_pk, db_node.pk)
+    
+    # A whole-tree save is one revision, snapshotted in full
+    if parent_pk is None:
+        history.record_change(db, project_pk, "replace")
+        db.commit()
 
 
 def get_node(db: Session, node_id: str) -> Optional[NodeModel]:
@@ -128,14 +174,14 @@ def get_node(db: Session, node_id: str) -> Optional[NodeModel]:
 
 def get_project_nodes(db: Session, project_id: str) -> List[NodeModel]:
     """Get all nodes for a project"""
-    return db.query(NodeModel).filter(NodeModel.project_id == project_id).all()
+    return db.query(NodeModel).join(Project).filter(Project.id == project_id).all()
 
 
 def get_root_node(db: Session, project_id: str) -> Optional[NodeModel]:
     """Get the root node of a project (node with no parent)"""
-    return db.query(NodeModel).filter(
-        NodeModel.project_id == project_id,
-        NodeModel.parent_id == None
+    return db.query(NodeModel).join(Project).filter(
+        Project.id == project_id,
+        NodeModel.parent_pk == None
     ).first()
 
 
@@ -143,11 +189,16 @@ def update_node(db: Session, node_id: str, updates: Dict) -> Optional[NodeModel]
     """Update a node with given fields"""
     node = get_node(db, node_id)
     if node:
+        changed = {}
         for key, value in updates.items():
-            if hasattr(node, key):
+            if hasattr(node, key) and getattr(node, key) != value:
                 setattr(node, key, value)
-        db.commit()
-        db.refresh(node)
+                changed[key] = value
+        # A request that changes nothing does not get a revision
+        if changed:
+            history.record_change(db, node.project_pk, "update", node.id, changed)
+            db.commit()
+            db.refresh(node)
     return node
 
 
@@ -156,18 +207,27 @@ def delete_node(db: Session, node_id: str) -> bool:
     node = get_node(db, node_id)
     if node:
         db.delete(node)
+        history.record_change(db, node.project_pk, "delete", node.id)
         db.commit()
         return True
     return False
 
 
-def build_tree_from_db(db_node: NodeModel, db: Session) -> Node:
-    """Recursively build a Node tree from database NodeModel"""
+def build_tree_from_db(db_node: NodeModel, db: Session,
+                       children_by_parent: Optional[Dict[int, List[NodeModel]]] = None) -> Node:
+    """Recursively build a Node tree from database NodeModel
+
+    children_by_parent, when given, maps parent_pk to already loaded children
+    so the tree is built without a query per node.
+    """
     # Get all children of this node
-    children_db = db.query(NodeModel).filter(NodeModel.parent_id == db_node.id).all()
+    if children_by_parent is not None:
+        children_db = children_by_parent.get(db_node.pk, [])
+    else:
+        children_db = db.query(NodeModel).filter(NodeModel.parent_pk == db_node.pk).order_by(NodeModel.pk).all()
     
     # Recursively build children
-    children = [build_tree_from_db(child, db) for child in children_db]
+    children = [build_tree_from_db(child, db, children_by_parent) for child in children_db]
     
     # Create the Node object
     return Node(
@@ -191,17 +251,90 @@ def build_tree_from_db(db_node: NodeModel, db: Session) -> Node:
 
 def get_project_tree(db: Session, project_id: str) -> Optional[Node]:
     """Get the complete tree structure for a project"""
-    root = get_root_node(db, project_id)
+    return load_project_tree(db, project_id)[0]
+
+
+def load_project_tree(db: Session, project_id: str) -> Tuple[Optional[Node], List[NodeModel]]:
+    """Tree of a project together with the stored nodes it was built from"""
+    # One query for the whole project; rollups rebuild the tree on every write
+    nodes = db.query(NodeModel).join(Project).filter(Project.id == project_id).order_by(NodeModel.pk).all()
+    root = None
+    children_by_parent: Dict[int, List[NodeModel]] = {}
+    for db_node in nodes:
+        if db_node.parent_pk is None:
+            root = root or db_node
+        else:
+            children_by_parent.setdefault(db_node.parent_pk, []).append(db_node)
     if root:
-        return build_tree_from_db(root, db)
-    return None
+        return build_tree_from_db(root, db, children_by_parent), nodes
+    return None, nodes
+
+
+def get_project_tree_at(db: Session, project_id: str, rev: int) -> Optional[Node]:
+    """Rebuild the tree of a project as it was at a past revision"""
+    project = get_project(db, project_id)
+    if not project:
+        return None
+    records = history.reconstruct(db, project.pk, rev)
+    if not records:
+        return None
+    
+    nodes = {}
+    root = None
+    for record in records:  # parents precede children
+        node = Node(**{k: v for k, v in record.items() if k != "parent_id"})
+        nodes[node.id] = node
+        parent = nodes.get(record["parent_id"])
+        if parent:
+            parent.children.append(node)
+        elif record["parent_id"] is None:
+            root = node
+    return root
 
 
 def update_tree_in_db(db: Session, node: Node, project_id: str):
     """Update the entire tree in the database (delete old, insert new)"""
+    project = get_project(db, project_id)
+    if not project:
+        return
+    
     # Delete all existing nodes for this project
-    db.query(NodeModel).filter(NodeModel.project_id == project_id).delete()
+    db.query(NodeModel).filter(NodeModel.project_pk == project.pk).delete()
     db.commit()
     
     # Save the new tree
-    save_tree_to_db(db, node, project_id)
+    save_tree_to_db(db, node, project.pk)
+
+
+def get_projects_using_materials(db: Session, materials: List[str]) -> List[str]:
+    """Get the ids of projects that contain at least one node made of the given materials"""
+    rows = db.query(Project.id).join(NodeModel).filter(
+        NodeModel.material.in_(materials)
+    ).distinct().all()
+    return [row[0] for row in rows]
+
+
+def save_rollups(db: Session, tree: Node, db_nodes: List[NodeModel]) -> int:
+    """Persist computed totals of an already-calculated tree onto its stored nodes
+
+    db_nodes are the rows the tree was loaded from (see load_project_tree).
+    """
+    rollups = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        rollups[node.id] = node
+        stack.extend(node.children)
+    
+    count = 0
+    for db_node in db_nodes:
+        node = rollups.get(db_node.id)
+        if node is None:
+            continue
+        db_node.display_id = node.display_id
+        db_node.total_cost = node.total_cost
+        db_node.total_weight = node.total_weight
+        db_node.co2_footprint = node.co2_footprint
+        count += 1
+    db.commit()
+    return count
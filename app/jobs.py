@@ -0,0 +1,200 @@
+"""
+In-process background jobs for CareSoft.
+
+Rollup recomputation is CPU bound (tree walk per project), so projects are
+fanned out to a ProcessPoolExecutor. Job bookkeeping (progress, cancellation)
+stays in the web process; no external broker is needed.
+"""
+from concurrent.futures import ProcessPoolExecutor, Future, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional, Dict
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+
+from app import analytics, calc, crud
+from app.database import SessionLocal, get_engine
+from app.search import part_index
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+
+MAX_WORKERS = int(os.getenv("RECOMPUTE_WORKERS", "0")) or os.cpu_count() or 1
+MAX_FINISHED_JOBS = 50
+
+
+# --- WORKER SIDE (runs in child processes) ---
+
+def recompute_project(project_id: str, material_master: Dict[str, float]) -> int:
+    """Recalculate and persist the rollups of one project; returns nodes written"""
+    calc.MATERIAL_MASTER.clear()
+    calc.MATERIAL_MASTER.update(material_master)
+
+    get_engine()
+    db = SessionLocal()
+    try:
+        written = calc.refresh_rollups(db, project_id)
+        if not written:
+            return 0
+        analytics.refresh_project(db, crud.get_project(db, project_id).pk)
+        return written
+    finally:
+        db.close()
+
+
+# --- JOB BOOKKEEPING (runs in the web process) ---
+
+class Job:
+    def __init__(self, kind: str, project_ids: List[str]):
+        self.id = f"job_{uuid.uuid4().hex[:12]}"
+        self.kind = kind
+        self.project_ids = project_ids
+        self.status = JOB_QUEUED if project_ids else JOB_COMPLETED
+        self.done = 0
+        self.failed = 0
+        self.settled = 0
+        self.errors: Dict[str, str] = {}
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None if project_ids else self.created_at
+        self.futures: List[Future] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_CANCELLED, JOB_FAILED)
+
+    def to_dict(self) -> Dict:
+        total = len(self.project_ids)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": total,
+            "done": self.done,
+            "failed": self.failed,
+            "progress": (self.done + self.failed) / total if total else 1.0,
+            "errors": self.errors,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers: int = MAX_WORKERS):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created on first use so importing the app does not spawn processes.
+        # Workers are spawned, not forked: forking the threaded web process can
+        # copy a lock held by another thread (e.g. the search index's) into the
+        # child, and it starts without inherited database connections.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _submit(self, *args) -> Future:
+        """Submit to the pool, replacing it once if a dead worker has broken it"""
+        try:
+            return self._get_executor().submit(*args)
+        except BrokenProcessPool:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            return self._get_executor().submit(*args)
+
+    def submit_recompute(self, project_ids: List[str], kind: str = "recompute") -> Job:
+        """Queue a rollup recompute for the given projects"""
+        job = Job(kind, list(dict.fromkeys(project_ids)))
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        if not job.project_ids:
+            return job
+
+        rates = dict(calc.MATERIAL_MASTER)
+        job.status = JOB_RUNNING
+        for i, project_id in enumerate(job.project_ids):
+            try:
+                future = self._submit(recompute_project, project_id, rates)
+            except Exception as e:
+                # Projects that never reached a worker fail instead of leaving the job running
+                with self._lock:
+                    for pid in job.project_ids[i:]:
+                        job.failed += 1
+                        job.errors[pid] = str(e) or type(e).__name__
+                        job.settled += 1
+                    self._settle(job)
+                break
+            job.futures.append(future)
+            future.add_done_callback(lambda f, pid=project_id: self._on_done(job, pid, f))
+        return job
+
+    def _on_done(self, job: Job, project_id: str, future: Future):
+        with self._lock:
+            try:
+                future.result()
+                job.done += 1
+                # Rollups were written by a child process, whose flush events
+                # never reach this process's search index
+                part_index.invalidate()
+            except CancelledError:
+                pass
+            except Exception as e:
+                job.failed += 1
+                job.errors[project_id] = str(e) or type(e).__name__
+
+            # Count settled futures rather than inspecting job.futures, which
+            # may still be filling up when an early project finishes
+            job.settled += 1
+            self._settle(job)
+
+    def _settle(self, job: Job):
+        """Finish the job once every project has settled; caller holds the lock"""
+        if job.finished or job.settled < len(job.project_ids):
+            return
+        if job.failed:
+            job.status = JOB_FAILED
+        else:
+            job.status = JOB_COMPLETED
+        job.finished_at = time.time()
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel the projects of a job that have not started yet"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        for future in job.futures:
+            future.cancel()
+        with self._lock:
+            if not job.finished:
+                job.status = JOB_CANCELLED
+                job.finished_at = time.time()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        finished.sort(key=lambda j: j.created_at)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+job_manager = JobManager()
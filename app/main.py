@@ -1,54 +1,82 @@
-from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi import FastAPI, Request, HTTPException, Depends, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import Session
+from contextlib import asynccontextmanager
 from typing import List, Optional, Dict
 import uuid
 import time
 
-from app.database import engine, get_db, Base
-from app import crud
-from app.crud import Node, ConfigState
-from app.models import NodeModel
-
-app = FastAPI(title="CareSoft Hardcore VAVE Hub - Pure Engineering")
+_import_started = time.perf_counter()
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+from app.database import get_engine, get_db, get_read_db, LAST_WRITE_COOKIE, READ_AFTER_WRITE_SECONDS, MAX_REPLICA_LAG_SECONDS
+from app import analytics, assets, crud, history, migrations
+from app.crud import Node, ConfigState
+from app.models import new_node_id
+from app.calc import MATERIAL_MASTER, calculate_totals, refresh_rollups
+from app.jobs import job_manager
+from app.search import search_parts, SearchFilters, SEARCH_MODES, MAX_PAGE_SIZE
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Schema changes are applied by `python init_db.py`; workers only verify
+    # the recorded version so they start without inspecting the schema.
+    try:
+        version = migrations.check_schema_version(get_engine())
+        print(f"--- STARTUP: schema version {version} ---")
+    except OperationalError as e:
+        print(f"--- STARTUP: database unreachable, schema check skipped ({e.orig}) ---")
+    # Building the manifest takes most of a second; it is done ahead of time
+    # by `python -m app.assets`, or else on the first page render
+    if not assets.manifest.load():
+        print("--- STARTUP: no asset manifest yet, it will be built on first render ---")
+    print(f"--- STARTUP: worker ready in {(time.perf_counter() - _import_started) * 1000:.0f} ms ---")
+    yield
+    job_manager.shutdown()
+
+app = FastAPI(title="CareSoft Hardcore VAVE Hub - Pure Engineering", lifespan=lifespan)
+
+class RevalidatingStaticFiles(StaticFiles):
+    """Unhashed /static URLs must revalidate; hashed copies are served from /assets"""
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+app.mount("/static", RevalidatingStaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["asset_url"] = assets.asset_url
 
 
-# Create database tables on startup
-Base.metadata.create_all(bind=engine)
+@app.middleware("http")
+async def remember_writes(request: Request, call_next):
+    # Clients that just wrote keep reading from the primary (see get_read_db)
+    response = await call_next(request)
+    if request.method not in ("GET", "HEAD", "OPTIONS") and response.status_code < 400:
+        max_age = int(max(READ_AFTER_WRITE_SECONDS, MAX_REPLICA_LAG_SECONDS)) + 1
+        response.set_cookie(LAST_WRITE_COOKIE, f"{time.time():.3f}", max_age=max_age, httponly=True, samesite="lax")
+    return response
 
 # GLOBAL STATE (for current session only)
 current_project_id = None
 
-def get_active_project(db: Session) -> Optional[Node]:
+def get_active_project_id(db: Session) -> Optional[str]:
     global current_project_id
     if not current_project_id:
         # Get the first project if none is selected
         projects = crud.get_all_projects(db)
         if projects:
             current_project_id = projects[0].id
-    
-    if current_project_id:
-        return crud.get_project_tree(db, current_project_id)
-    return None
+    return current_project_id
 
+def get_active_project(db: Session) -> Optional[Node]:
+    project_id = get_active_project_id(db)
+    if project_id:
+        return crud.get_project_tree(db, project_id)
+    return None
 
-# MATERIAL & CO2 MASTER (Local Economics)
-MATERIAL_MASTER = {
-    "Steel (HSS)": 120.0,
-    "Aluminum 6061": 320.0,
-    "Polypropylene": 180.0,
-    "Cast Iron": 95.0,
-    "Copper": 850.0,
-    "Lithium-Ion": 1200.0,
-    "Rubber (EPDM)": 210.0,
-    "Composite": 450.0
-}
-CO2_FACTORS = {"Steel (HSS)": 2.5, "Aluminum 6061": 12.0, "Polypropylene": 1.8, "Cast Iron": 3.2, "Copper": 4.5, "Lithium-Ion": 15.0, "Rubber (EPDM)": 2.3, "Composite": 3.5}
 
 # --- THE EXHAUSTIVE TEARDOWN ENGINE ---
 
@@ -273,34 +301,6 @@ def build_full_tree(cfg: ConfigState):
     enable_metal_logic(root)
     return root
 
-# --- CALC ENGINE ---
-
-def calculate_totals(node: Node, prefix: str = ""):
-    node.display_id = prefix
-    agg_cost = 0.0
-    agg_weight = 0.0
-    agg_co2 = 0.0
-    
-    mat_rate = MATERIAL_MASTER.get(node.material, 0.0) if node.material_calc_enabled else 0.0
-    self_part_cost = node.own_cost * node.quantity
-    
-    if node.material_calc_enabled:
-        self_co2 = (node.weight / 1000.0) * CO2_FACTORS.get(node.material, 0.0) * node.quantity
-    else:
-        self_co2 = 0.0 # or some other logic for non-metal parts
-    
-    for i, child in enumerate(node.children, 1):
-        new_prefix = f"{prefix}.{i}" if prefix else str(i)
-        res_cost, res_weight, res_co2 = calculate_totals(child, new_prefix)
-        agg_cost += res_cost
-        agg_weight += res_weight
-        agg_co2 += res_co2
-        
-    node.total_cost = self_part_cost + agg_cost
-    node.total_weight = (node.weight * node.quantity) + agg_weight
-    node.co2_footprint = self_co2 + agg_co2
-    return node.total_cost, node.total_weight, node.co2_footprint
-
 def find_node(node: Node, target_id: str) -> Optional[Node]:
     if node.id == target_id: return node
     for child in node.children:
@@ -329,47 +329,38 @@ async def initialize_user_space(req: dict, db: Session = Depends(get_db)):
         "assets_created": ["audit_log", f"data_{role}"]
     }
 
+@app.get(assets.ASSET_URL_PREFIX + "/{path:path}")
+async def hashed_asset(path: str, request: Request):
+    return assets.asset_response(path, request.headers.get("accept-encoding", ""))
+
 @app.get("/cache-test", response_class=HTMLResponse)
 async def cache_test(request: Request):
     return templates.TemplateResponse("cache_test.html", {"request": request})
 
 @app.get("/api/tree")
-async def get_tree(db: Session = Depends(get_db)):
-    root = get_active_project(db)
-    if root:
-        calculate_totals(root)
+async def get_tree(rev: Optional[int] = Query(None, ge=1), db: Session = Depends(get_read_db)):
+    if rev is None:
+        # The live tree already carries the rollups stored on every write
+        return get_active_project(db)
+    project_id = get_active_project_id(db)
+    root = crud.get_project_tree_at(db, project_id, rev) if project_id else None
+    if root is None:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    calculate_totals(root)
     return root
 
+@app.get("/api/tree/history")
+async def get_tree_history(limit: int = Query(100, ge=1, le=1000), db: Session = Depends(get_read_db)):
+    project_id = get_active_project_id(db)
+    project = crud.get_project(db, project_id) if project_id else None
+    if not project:
+        return []
+    return history.list_revisions(db, project.pk, limit=limit)
+
 @app.get("/api/projects")
-async def list_projects(db: Session = Depends(get_db)):
-    # Get all projects from database
-    projects = crud.get_all_projects(db)
-    summary = []
-    for project in projects:
-        # Get the tree for calculation
-        tree = crud.get_project_tree(db, project.id)
-        if tree:
-            calculate_totals(tree)
-            summary.append({
-                "id": project.id, 
-                "name": project.name, 
-                "total_cost": tree.total_cost, 
-                "total_weight": tree.total_weight,
-                "config": project.config,
-                "status": project.status,
-                "part_count": count_nodes(tree),
-                "tracked_parts": count_tracked_parts(tree)
-            })
-    return summary
-
-def count_nodes(node: Node) -> int:
-    return 1 + sum(count_nodes(c) for c in node.children)
-
-def count_tracked_parts(node: Node) -> int:
-    # A part is 'tracked' if it has a non-zero own_cost or if it's a leaf node with cost? 
-    # USER: "if i enter an cost for two part it should increment +2"
-    count = 1 if node.own_cost > 0 else 0
-    return count + sum(count_tracked_parts(c) for c in node.children)
+async def list_projects(db: Session = Depends(get_read_db)):
+    # Totals come from the rollups stored on every write (see refresh_rollups)
+    return crud.get_project_summaries(db)
 
 @app.post("/api/project/select")
 async def select_project(req: dict):
@@ -396,7 +387,9 @@ async def new_project(req: ConfigState, db: Session = Depends(get_db)):
     # Reset costs and save tree to database
     reset_costs(new_tree)
     new_tree.id = project.id
-    crud.save_tree_to_db(db, new_tree, project.id)
+    crud.save_tree_to_db(db, new_tree, project.pk)
+    refresh_rollups(db, project.id)
+    analytics.refresh_project(db, project.pk)
     
     current_project_id = project.id
     return {"status": "success", "id": project.id}
@@ -411,10 +404,80 @@ async def get_materials():
     return MATERIAL_MASTER
 
 @app.post("/api/materials/update")
-async def update_materials(req: Dict[str, float]):
-    global MATERIAL_MASTER
+async def update_materials(req: Dict[str, float], db: Session = Depends(get_db)):
+    changed = [m for m, rate in req.items() if MATERIAL_MASTER.get(m) != rate]
     MATERIAL_MASTER.update(req)
-    return {"status": "success"}
+    if not changed:
+        return {"status": "success", "job_id": None}
+    
+    # Refresh stored rollups of every project using a re-priced material
+    affected = crud.get_projects_using_materials(db, changed)
+    job = job_manager.submit_recompute(affected, kind="materials")
+    return {"status": "success", "job_id": job.id}
+
+# --- PART SEARCH ---
+
+@app.get("/api/search")
+async def search(
+    q: str = Query(..., min_length=1),
+    mode: str = "prefix",
+    material: Optional[str] = None,
+    min_cost: Optional[float] = None,
+    max_cost: Optional[float] = None,
+    project_status: Optional[str] = None,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_read_db)
+):
+    if mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(SEARCH_MODES)}")
+    filters = SearchFilters(material=material, min_cost=min_cost, max_cost=max_cost, project_status=project_status)
+    return search_parts(db, q, mode=mode, filters=filters, page=page, page_size=page_size)
+
+# --- ANALYTICS ---
+
+@app.get("/api/analytics")
+async def get_analytics(
+    group_by: str = "system",
+    project_id: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    db: Session = Depends(get_read_db)
+):
+    if group_by not in analytics.GROUP_BY_OPTIONS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(analytics.GROUP_BY_OPTIONS)}")
+    project_pk = None
+    if project_id:
+        project = crud.get_project(db, project_id)
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+        project_pk = project.pk
+    return analytics.get_breakdown(db, group_by=group_by, project_pk=project_pk, limit=limit)
+
+# --- BACKGROUND JOBS ---
+
+@app.post("/api/jobs/recompute")
+async def start_recompute(req: dict, db: Session = Depends(get_db)):
+    project_ids = req.get("project_ids") or [p.id for p in crud.get_all_projects(db)]
+    job = job_manager.submit_recompute(project_ids)
+    return {"status": "success", "job_id": job.id}
+
+@app.get("/api/jobs")
+async def list_jobs():
+    return [job.to_dict() for job in job_manager.list()]
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"status": "success", "job": job.to_dict()}
 
 @app.post("/api/node/update")
 async def update_node(req: dict, db: Session = Depends(get_db)):
@@ -432,6 +495,8 @@ async def update_node(req: dict, db: Session = Depends(get_db)):
     
     node = crud.update_node(db, req['id'], updates)
     if node:
+        refresh_rollups(db, node.project.id)
+        analytics.refresh_system(db, node.project_pk, analytics.get_system(node).pk)
         return {"status": "success"}
     return {"status": "error"}
 
@@ -446,12 +511,7 @@ async def add_node(req: dict, db: Session = Depends(get_db)):
     if not parent:
         return {"status": "error", "message": "Parent node not found"}
     
-    # Get children count for unique ID
-    children_count = db.query(NodeModel).filter(
-        NodeModel.parent_id == parent.id
-    ).count()
-    
-    new_id = f"{parent.id}-n-{children_count}"
+    new_id = new_node_id()
     new_node = Node(
         id=new_id,
         name=req.get('name', 'New Branch/Part'),
@@ -460,8 +520,11 @@ async def add_node(req: dict, db: Session = Depends(get_db)):
     )
     
     # Save to database
-    db_node = crud.create_node(db, new_node, current_project_id, parent.id)
+    db_node = crud.create_node(db, new_node, parent.project_pk, parent.pk)
     if db_node:
+        # Sibling numbering and ancestor totals change with the new node
+        refresh_rollups(db, db_node.project.id)
+        analytics.refresh_system(db, db_node.project_pk, analytics.get_system(db_node).pk)
         return {"status": "success", "new_id": new_id}
     return {"status": "error", "message": "Failed to create node"}
 
@@ -506,10 +569,14 @@ async def delete_node_api(req: dict, db: Session = Depends(get_db)):
         return {"status": "error", "message": "Node not found"}
     
     # Check if this is a root node (no parent)
-    if node.parent_id is None:
+    if node.parent_pk is None:
         return {"status": "error", "message": "Cannot delete root node"}
     
+    project_id, project_pk, system_pk = node.project.id, node.project_pk, analytics.get_system(node).pk
     success = crud.delete_node(db, node_id)
+    if success:
+        refresh_rollups(db, project_id)
+        analytics.refresh_system(db, project_pk, system_pk)
     return {"status": "success" if success else "error"}
 
 
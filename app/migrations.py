@@ -0,0 +1,213 @@
+"""
+Versioned schema migrations for CareSoft.
+
+Each migration is a function registered with @migration(version, description)
+that receives an open connection inside its own transaction. Table definitions
+used here are frozen copies, never the live ORM models, so old migrations keep
+producing the schema they were written for.
+
+Apply pending migrations with `python init_db.py`; the app only checks the
+recorded version at startup.
+"""
+from sqlalchemy import (
+    MetaData, Table, Column, String, Float, Integer, BigInteger, Boolean, JSON,
+    ForeignKey, DateTime, Identity, LargeBinary, UniqueConstraint, inspect, select, func
+)
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from typing import Callable, List, Optional, Tuple
+
+SCHEMA_VERSION_TABLE = "schema_version"
+# Tables that existed before versioned migrations were introduced
+LEGACY_TABLES = ("projects", "nodes")
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = []
+
+_version_metadata = MetaData()
+schema_version = Table(
+    SCHEMA_VERSION_TABLE, _version_metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now())
+)
+
+
+def migration(version: int, description: str):
+    """Register an upgrade step; versions must be added in increasing order"""
+    def register(fn: Callable[[Connection], None]):
+        if MIGRATIONS and MIGRATIONS[-1][0] >= version:
+            raise ValueError(f"Migration {version} registered out of order")
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def head_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn: Connection) -> int:
+    """Highest applied migration, or 0 for an empty database
+
+    Inspects the schema, so it is meant for init_db.py (upgrade and --status),
+    not for worker startup. Raises RuntimeError for a database whose tables were created outside the
+    migrations (the old create_all at import): migration 1 would skip those
+    tables and stamp a schema that does not match the code.
+    """
+    insp = inspect(conn)
+    versioned = insp.has_table(SCHEMA_VERSION_TABLE)
+    legacy = [table for table in LEGACY_TABLES if insp.has_table(table)]
+    if versioned:
+        # Databases stamped before this check still carry the string-key tables
+        legacy = [table for table in legacy if "pk" not in {c["name"] for c in insp.get_columns(table)}]
+    if legacy:
+        raise RuntimeError(
+            f"Legacy schema: table(s) {', '.join(legacy)} were not created by migrations. "
+            f"Recreate the database (e.g. `docker-compose down -v`) or convert it to "
+            f"integer surrogate keys before running `python init_db.py`."
+        )
+    if not versioned:
+        return 0
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def upgrade(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """Apply pending migrations up to target (default: head); returns applied versions"""
+    target = head_version() if target is None else target
+    with engine.begin() as conn:
+        version = current_version(conn)
+        schema_version.create(conn, checkfirst=True)
+
+    applied = []
+    for mig_version, description, fn in MIGRATIONS:
+        if mig_version <= version or mig_version > target:
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(schema_version.insert().values(version=mig_version, description=description))
+        applied.append(mig_version)
+    return applied
+
+
+def check_schema_version(engine: Engine) -> int:
+    """Fail fast if the database schema does not match this code
+
+    Runs on every worker start, so it issues one query and no schema
+    inspection; a database without schema_version counts as version 0.
+    """
+    with engine.connect() as conn:
+        try:
+            version = conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+        except DBAPIError as e:
+            if e.connection_invalidated:
+                raise
+            # Missing schema_version table: the database was never migrated
+            version = 0
+    if version != head_version():
+        raise RuntimeError(
+            f"Database schema is at version {version}, code expects {head_version()}. "
+            f"Run `python init_db.py` to migrate."
+        )
+    return version
+
+
+# --- MIGRATIONS ---
+
+SurrogateKey = BigInteger().with_variant(Integer(), "sqlite")
+
+
+@migration(1, "initial projects and nodes schema")
+def _initial_schema(conn: Connection):
+    metadata = MetaData()
+    Table(
+        "projects", metadata,
+        Column("pk", SurrogateKey, Identity(), primary_key=True),
+        Column("id", String, unique=True, index=True, nullable=False),
+        Column("name", String, nullable=False),
+        Column("status", String),
+        Column("config", JSON, nullable=False),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+        Column("updated_at", DateTime(timezone=True))
+    )
+    Table(
+        "nodes", metadata,
+        Column("pk", SurrogateKey, Identity(), primary_key=True),
+        Column("id", String, unique=True, index=True, nullable=False),
+        Column("project_pk", SurrogateKey, ForeignKey("projects.pk", ondelete="CASCADE"), index=True, nullable=False),
+        Column("parent_pk", SurrogateKey, ForeignKey("nodes.pk", ondelete="CASCADE"), index=True, nullable=True),
+        Column("name", String, nullable=False),
+        Column("display_id", String),
+        Column("level", Integer, nullable=False),
+        Column("own_cost", Float),
+        Column("weight", Float),
+        Column("quantity", Integer),
+        Column("material_calc_enabled", Boolean),
+        Column("material", String),
+        Column("config", JSON),
+        Column("status", String),
+        Column("total_cost", Float),
+        Column("total_weight", Float),
+        Column("co2_footprint", Float),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+        Column("updated_at", DateTime(timezone=True))
+    )
+    # No checkfirst: current_version() has already refused pre-existing tables
+    metadata.create_all(conn, checkfirst=False)
+
+
+@migration(2, "part search indexes")
+def _part_search_indexes(conn: Connection):
+    conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_nodes_own_cost ON nodes (own_cost)")
+    if conn.dialect.name != "postgresql":
+        # Other databases are served by the in-memory index in app/search.py
+        return
+    conn.exec_driver_sql("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for column in ("name", "material", "display_id"):
+        conn.exec_driver_sql(
+            f"CREATE INDEX IF NOT EXISTS ix_nodes_{column}_trgm ON nodes USING gin ({column} gin_trgm_ops)"
+        )
+
+
+@migration(3, "cost analytics cube")
+def _cost_cube(conn: Connection):
+    metadata = MetaData()
+    Table("projects", metadata, Column("pk", SurrogateKey, primary_key=True))
+    Table("nodes", metadata, Column("pk", SurrogateKey, primary_key=True))
+    Table(
+        "cost_cube", metadata,
+        Column("project_pk", SurrogateKey, ForeignKey("projects.pk", ondelete="CASCADE"), primary_key=True),
+        Column("system_pk", SurrogateKey, ForeignKey("nodes.pk", ondelete="CASCADE"), primary_key=True),
+        Column("material", String, primary_key=True, index=True),
+        Column("total_cost", Float),
+        Column("total_weight", Float),
+        Column("co2_footprint", Float),
+        Column("part_count", Integer),
+        Column("updated_at", DateTime(timezone=True), server_default=func.now())
+    )
+    metadata.tables["cost_cube"].create(conn, checkfirst=True)
+
+
+@migration(4, "node change log and tree snapshots")
+def _revision_history(conn: Connection):
+    metadata = MetaData()
+    Table("projects", metadata, Column("pk", SurrogateKey, primary_key=True))
+    Table(
+        "node_changes", metadata,
+        Column("pk", SurrogateKey, Identity(), primary_key=True),
+        Column("project_pk", SurrogateKey, ForeignKey("projects.pk", ondelete="CASCADE"), nullable=False),
+        Column("rev", Integer, nullable=False),
+        Column("op", String, nullable=False),
+        Column("node_id", String, nullable=True),
+        Column("data", JSON),
+        Column("created_at", DateTime(timezone=True), server_default=func.now()),
+        UniqueConstraint("project_pk", "rev", name="uq_node_changes_project_rev")
+    )
+    Table(
+        "tree_snapshots", metadata,
+        Column("project_pk", SurrogateKey, ForeignKey("projects.pk", ondelete="CASCADE"), primary_key=True),
+        Column("rev", Integer, primary_key=True),
+        Column("data", LargeBinary, nullable=False),
+        Column("created_at", DateTime(timezone=True), server_default=func.now())
+    )
+    metadata.tables["node_changes"].create(conn, checkfirst=True)
+    metadata.tables["tree_snapshots"].create(conn, checkfirst=True)
@@ -1,13 +1,17 @@
-from sqlalchemy import Column, String, Float, Integer, Boolean, JSON, ForeignKey, DateTime
+from sqlalchemy import Column, String, Float, Integer, BigInteger, Boolean, JSON, ForeignKey, DateTime, Identity, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
 import uuid
 
+# BIGINT identity on PostgreSQL; SQLite only auto-increments INTEGER PRIMARY KEY
+SurrogateKey = BigInteger().with_variant(Integer(), "sqlite")
+
 class Project(Base):
     __tablename__ = "projects"
     
-    id = Column(String, primary_key=True, default=lambda: f"prog_{uuid.uuid4().hex[:12]}")
+    pk = Column(SurrogateKey, Identity(), primary_key=True)
+    id = Column(String, unique=True, index=True, nullable=False, default=lambda: f"prog_{uuid.uuid4().hex[:12]}")
     name = Column(String, nullable=False)
     status = Column(String, default="In-Progress")  # "In-Progress" or "Completed"
     config = Column(JSON, nullable=False)  # Store ConfigState as JSON
@@ -24,14 +28,17 @@ class Project(Base):
 class NodeModel(Base):
     __tablename__ = "nodes"
     
-    id = Column(String, primary_key=True)
-    project_id = Column(String, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
-    parent_id = Column(String, ForeignKey("nodes.id", ondelete="CASCADE"), nullable=True)
+    # Integer surrogate keys keep indexes and parent/project joins small;
+    # the human-facing string id is only used for lookups from the API.
+    pk = Column(SurrogateKey, Identity(), primary_key=True)
+    id = Column(String, unique=True, index=True, nullable=False)
+    project_pk = Column(SurrogateKey, ForeignKey("projects.pk", ondelete="CASCADE"), index=True, nullable=False)
+    parent_pk = Column(SurrogateKey, ForeignKey("nodes.pk", ondelete="CASCADE"), index=True, nullable=True)
     
     name = Column(String, nullable=False)
     display_id = Column(String, default="")
     level = Column(Integer, nullable=False)
-    own_cost = Column(Float, default=0.0)
+    own_cost = Column(Float, default=0.0, index=True)
     weight = Column(Float, default=0.0)
     quantity = Column(Integer, default=1)
     material_calc_enabled = Column(Boolean, default=True)
@@ -47,15 +54,73 @@ class NodeModel(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
+    # name, material and display_id also carry pg_trgm GIN indexes on
+    # PostgreSQL for part search (see migration 2 in app/migrations.py)
+    
     # Relationships
     project = relationship("Project", back_populates="nodes")
     children = relationship(
         "NodeModel",
         back_populates="parent",
         cascade="all, delete-orphan",
-        foreign_keys=[parent_id]
+        foreign_keys=[parent_pk],
+        order_by=lambda: NodeModel.pk
     )
-    parent = relationship("NodeModel", back_populates="children", remote_side=[id])
+    parent = relationship("NodeModel", back_populates="children", remote_side=[pk])
     
     def __repr__(self):
         return f"<NodeModel(id={self.id}, name={self.name}, level={self.level})>"
+
+
+class CostCube(Base):
+    """Precomputed cost/weight/CO2 per (project, level-1 system, material)"""
+    __tablename__ = "cost_cube"
+    
+    project_pk = Column(SurrogateKey, ForeignKey("projects.pk", ondelete="CASCADE"), primary_key=True)
+    system_pk = Column(SurrogateKey, ForeignKey("nodes.pk", ondelete="CASCADE"), primary_key=True)
+    material = Column(String, primary_key=True, index=True)
+    
+    total_cost = Column(Float, default=0.0)
+    total_weight = Column(Float, default=0.0)
+    co2_footprint = Column(Float, default=0.0)
+    part_count = Column(Integer, default=0)
+    
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<CostCube(project_pk={self.project_pk}, system_pk={self.system_pk}, material={self.material})>"
+
+
+class NodeChange(Base):
+    """Append-only log of node writes; rev numbers are per project"""
+    __tablename__ = "node_changes"
+    __table_args__ = (UniqueConstraint("project_pk", "rev", name="uq_node_changes_project_rev"),)
+    
+    pk = Column(SurrogateKey, Identity(), primary_key=True)
+    project_pk = Column(SurrogateKey, ForeignKey("projects.pk", ondelete="CASCADE"), nullable=False)
+    rev = Column(Integer, nullable=False)
+    op = Column(String, nullable=False)  # "replace", "create", "update" or "delete"
+    node_id = Column(String, nullable=True)
+    data = Column(JSON, default={})
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<NodeChange(project_pk={self.project_pk}, rev={self.rev}, op={self.op})>"
+
+
+class TreeSnapshot(Base):
+    """Compressed flattened tree of a project as of a revision"""
+    __tablename__ = "tree_snapshots"
+    
+    project_pk = Column(SurrogateKey, ForeignKey("projects.pk", ondelete="CASCADE"), primary_key=True)
+    rev = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)  # zlib-compressed JSON list of node records
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    def __repr__(self):
+        return f"<TreeSnapshot(project_pk={self.project_pk}, rev={self.rev})>"
+
+
+def new_node_id() -> str:
+    """Allocate a human-facing node id without querying existing siblings"""
+    return f"n_{uuid.uuid4().hex[:12]}"
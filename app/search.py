@@ -0,0 +1,273 @@
+"""
+Part search across all projects.
+
+On PostgreSQL queries run against pg_trgm GIN indexes on nodes.name,
+nodes.material and nodes.display_id (see migration 2). Other databases
+(SQLite in local development) use an in-memory index that is rebuilt from
+the primary database when nodes or projects change.
+"""
+from bisect import bisect_left
+from sqlalchemy import event, select, func, literal, or_
+from sqlalchemy.orm import Session
+from typing import List, Optional, Dict, Tuple
+import threading
+
+from app.database import SessionLocal, get_engine
+from app.models import Project, NodeModel
+
+SEARCH_MODES = ("prefix", "contains", "fuzzy")
+FUZZY_THRESHOLD = 0.3
+MAX_PAGE_SIZE = 100
+SEARCH_FIELDS = ("name", "material", "display_id")
+
+
+class SearchFilters:
+    def __init__(self, material: Optional[str] = None, min_cost: Optional[float] = None,
+                 max_cost: Optional[float] = None, project_status: Optional[str] = None):
+        self.material = material
+        self.min_cost = min_cost
+        self.max_cost = max_cost
+        self.project_status = project_status
+
+
+def trigrams(text: str) -> set:
+    """pg_trgm style trigrams: lower-cased words padded with two leading and one trailing space"""
+    grams = set()
+    for word in "".join(c if c.isalnum() else " " for c in text.lower()).split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+# --- POSTGRESQL ---
+
+def _escape_like(q: str) -> str:
+    return q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _search_postgres(db: Session, q: str, mode: str, filters: SearchFilters,
+                     offset: int, limit: int) -> List[Tuple[int, float]]:
+    columns = [getattr(NodeModel, f) for f in SEARCH_FIELDS]
+    if mode == "fuzzy":
+        score = func.greatest(*[func.similarity(c, q) for c in columns])
+        match = or_(*[c.op("%")(q) for c in columns])
+        order = [score.desc(), NodeModel.pk]
+    else:
+        pattern = f"{_escape_like(q)}%" if mode == "prefix" else f"%{_escape_like(q)}%"
+        score = literal(1.0)
+        match = or_(*[c.ilike(pattern, escape="\\") for c in columns])
+        order = [NodeModel.name, NodeModel.pk]
+
+    query = select(NodeModel.pk, score).join(Project).where(match)
+    if filters.material:
+        query = query.where(NodeModel.material == filters.material)
+    if filters.min_cost is not None:
+        query = query.where(NodeModel.own_cost >= filters.min_cost)
+    if filters.max_cost is not None:
+        query = query.where(NodeModel.own_cost <= filters.max_cost)
+    if filters.project_status:
+        query = query.where(Project.status == filters.project_status)
+
+    if mode == "fuzzy":
+        db.execute(select(func.set_config("pg_trgm.similarity_threshold", str(FUZZY_THRESHOLD), True)))
+    rows = db.execute(query.order_by(*order).offset(offset).limit(limit)).all()
+    return [(pk, float(s)) for pk, s in rows]
+
+
+# --- IN-MEMORY FALLBACK ---
+
+class PartIndex:
+    """Prefix and trigram index over every node, shared by the whole process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Bumped by every write; the index is fresh while _built matches it.
+        # A write landing during a rebuild leaves _built behind, so the next
+        # search rebuilds again instead of keeping the stale rows.
+        self._generation_lock = threading.Lock()
+        self._generation = 0
+        self._built = -1
+        self._rows: List[Tuple] = []
+        self._prefix: List[Tuple[str, int]] = []
+        self._grams: Dict[str, set] = {}
+        self._row_grams: List[set] = []
+
+    def invalidate(self):
+        with self._generation_lock:
+            self._generation += 1
+
+    def _is_fresh(self) -> bool:
+        with self._generation_lock:
+            return self._built == self._generation
+
+    def _rebuild(self):
+        with self._generation_lock:
+            generation = self._generation
+        # Always read the primary: invalidation only follows primary writes, so
+        # rows taken from a lagging replica would be marked fresh and stay stale
+        get_engine()
+        db = SessionLocal()
+        try:
+            rows = db.execute(
+                select(NodeModel.pk, NodeModel.name, NodeModel.material, NodeModel.display_id,
+                       NodeModel.own_cost, Project.status)
+                .join(Project)
+                .order_by(NodeModel.name, NodeModel.pk)
+            ).all()
+        finally:
+            db.close()
+        prefix, grams, row_grams = [], {}, []
+        for i, row in enumerate(rows):
+            fields = [row.name or "", row.material or "", row.display_id or ""]
+            for text in fields:
+                prefix.append((text.lower(), i))
+            row_gram = set()
+            for text in fields:
+                row_gram |= trigrams(text)
+            for g in row_gram:
+                grams.setdefault(g, set()).add(i)
+            row_grams.append(row_gram)
+        prefix.sort()
+        self._rows, self._prefix, self._grams, self._row_grams = rows, prefix, grams, row_grams
+        self._built = generation
+
+    def search(self, q: str, mode: str, filters: SearchFilters,
+               offset: int, limit: int) -> List[Tuple[int, float]]:
+        with self._lock:
+            if not self._is_fresh():
+                self._rebuild()
+            rows, prefix, grams, row_grams = self._rows, self._prefix, self._grams, self._row_grams
+
+        needle = q.lower()
+        if mode == "prefix":
+            hits = set()
+            i = bisect_left(prefix, (needle, -1))
+            while i < len(prefix) and prefix[i][0].startswith(needle):
+                hits.add(prefix[i][1])
+                i += 1
+            scored = [(i, 1.0) for i in sorted(hits)]
+        elif mode == "contains":
+            scored = [(i, 1.0) for i, row in enumerate(rows)
+                      if any(needle in (getattr(row, f) or "").lower() for f in SEARCH_FIELDS)]
+        else:
+            q_grams = trigrams(q)
+            candidates = set()
+            for g in q_grams:
+                candidates |= grams.get(g, set())
+            scored = []
+            for i in candidates:
+                row = rows[i]
+                score = max(similarity(q_grams, trigrams(getattr(row, f) or "")) for f in SEARCH_FIELDS)
+                if score >= FUZZY_THRESHOLD:
+                    scored.append((i, score))
+            scored.sort(key=lambda s: (-s[1], s[0]))
+
+        results = []
+        for i, score in scored:
+            row = rows[i]
+            if filters.material and row.material != filters.material:
+                continue
+            if filters.min_cost is not None and (row.own_cost or 0.0) < filters.min_cost:
+                continue
+            if filters.max_cost is not None and (row.own_cost or 0.0) > filters.max_cost:
+                continue
+            if filters.project_status and row.status != filters.project_status:
+                continue
+            results.append((row.pk, score))
+            if len(results) >= offset + limit:
+                break
+        return results[offset:]
+
+
+part_index = PartIndex()
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _invalidate_on_flush(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (NodeModel, Project)):
+            part_index.invalidate()
+            return
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _invalidate_on_bulk_write(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete:
+        part_index.invalidate()
+
+
+# --- PUBLIC API ---
+
+def get_ancestor_paths(db: Session, pks: List[int]) -> Dict[int, List[Dict]]:
+    """Root-to-parent path of each node, resolved with one recursive query"""
+    if not pks:
+        return {}
+    anc = (
+        select(NodeModel.pk.label("hit_pk"), NodeModel.parent_pk.label("next_pk"), literal(0).label("depth"))
+        .where(NodeModel.pk.in_(pks))
+        .cte("ancestors", recursive=True)
+    )
+    parent = NodeModel.__table__.alias("parent")
+    anc = anc.union_all(
+        select(anc.c.hit_pk, parent.c.parent_pk, anc.c.depth + 1)
+        .join(parent, parent.c.pk == anc.c.next_pk)
+    )
+    rows = db.execute(
+        select(anc.c.hit_pk, anc.c.depth, NodeModel.id, NodeModel.name, NodeModel.display_id)
+        .join(NodeModel, NodeModel.pk == anc.c.next_pk)
+        .order_by(anc.c.hit_pk, anc.c.depth.desc())
+    ).all()
+    paths = {pk: [] for pk in pks}
+    for row in rows:
+        paths[row.hit_pk].append({"id": row.id, "name": row.name, "display_id": row.display_id})
+    return paths
+
+
+def search_parts(db: Session, q: str, mode: str = "prefix", filters: Optional[SearchFilters] = None,
+                 page: int = 1, page_size: int = 20) -> Dict:
+    """Search nodes of every project; returns one page of hits with their ancestor paths"""
+    filters = filters or SearchFilters()
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), MAX_PAGE_SIZE)
+    offset = (page - 1) * page_size
+
+    # Fetch one extra hit to know whether another page exists without counting
+    if db.get_bind().dialect.name == "postgresql":
+        hits = _search_postgres(db, q, mode, filters, offset, page_size + 1)
+    else:
+        hits = part_index.search(q, mode, filters, offset, page_size + 1)
+    has_more = len(hits) > page_size
+    hits = hits[:page_size]
+
+    pks = [pk for pk, _ in hits]
+    nodes = {n.pk: n for n in db.query(NodeModel).filter(NodeModel.pk.in_(pks)).all()} if pks else {}
+    projects = {p.pk: p for p in db.query(Project).filter(Project.pk.in_({n.project_pk for n in nodes.values()})).all()} if nodes else {}
+    paths = get_ancestor_paths(db, pks)
+
+    results = []
+    for pk, score in hits:
+        node = nodes.get(pk)
+        if node is None:
+            # Indexed from the primary but not yet replicated to this session's database
+            continue
+        project = projects[node.project_pk]
+        results.append({
+            "id": node.id,
+            "name": node.name,
+            "display_id": node.display_id,
+            "material": node.material,
+            "level": node.level,
+            "own_cost": node.own_cost,
+            "quantity": node.quantity,
+            "total_cost": node.total_cost,
+            "score": score,
+            "project": {"id": project.id, "name": project.name, "status": project.status},
+            "path": paths.get(pk, [])
+        })
+    return {"query": q, "mode": mode, "page": page, "page_size": page_size, "has_more": has_more, "results": results}
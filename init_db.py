@@ -1,15 +1,39 @@
 """
-Database initialization script for CareSoft application.
-Run this to create all database tables.
+Database migration script for CareSoft application.
+Run this to create or upgrade all database tables:
+
+    python init_db.py            # apply pending migrations
+    python init_db.py --status   # show current and expected schema version
 """
-from app.database import engine, Base
-from app.models import Project, NodeModel
+import sys
+
+from app.database import get_engine
+from app import migrations
 
 def init_db():
-    """Create all database tables"""
-    print("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
-    print("✓ Database tables created successfully!")
+    """Apply all pending schema migrations"""
+    print("Migrating database schema...")
+    applied = migrations.upgrade(get_engine())
+    for version, description, _ in migrations.MIGRATIONS:
+        if version in applied:
+            print(f"  ✓ {version:04d} {description}")
+    if not applied:
+        print("✓ Database schema already up to date!")
+    else:
+        print(f"✓ Database schema at version {migrations.head_version()}!")
+
+def show_status():
+    with get_engine().connect() as conn:
+        version = migrations.current_version(conn)
+    print(f"Current schema version: {version}")
+    print(f"Expected schema version: {migrations.head_version()}")
 
 if __name__ == "__main__":
-    init_db()
+    try:
+        if "--status" in sys.argv[1:]:
+            show_status()
+        else:
+            init_db()
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
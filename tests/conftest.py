@@ -0,0 +1,22 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import migrations
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """Empty SQLite database file, not yet migrated"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'caresoft.db'}")
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def db(engine):
+    """Session on a database migrated to the current schema"""
+    migrations.upgrade(engine)
+    session = sessionmaker(bind=engine, autocommit=False, autoflush=False)()
+    yield session
+    session.close()
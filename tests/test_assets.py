@@ -0,0 +1,52 @@
+import pytest
+from fastapi import HTTPException
+
+from app import assets
+
+
+def test_accepted_encodings_parses_q_values():
+    assert assets._accepted_encodings("gzip, br;q=0.5, identity;q=0, *;q=abc") == {
+        "gzip": 1.0, "br": 0.5, "identity": 0.0, "*": 0.0
+    }
+    assert assets._accepted_encodings("") == {}
+
+
+@pytest.fixture
+def dist(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, "DIST_DIR", str(tmp_path))
+    for name in ("app.abc.js", "app.abc.js.gz", "app.abc.js.br", "only-gz.abc.css", "only-gz.abc.css.gz"):
+        (tmp_path / name).write_bytes(b"x")
+    return tmp_path
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("br;q=0.5, gzip;q=0.8", "gzip"),
+    ("gzip;q=0, br;q=0", None),
+    ("*", "br"),
+    ("*;q=0", None),
+    ("br;q=0, *", "gzip"),
+    ("identity", None),
+    ("", None),
+])
+def test_asset_response_picks_best_accepted_variant(dist, accept_encoding, expected):
+    response = assets.asset_response("app.abc.js", accept_encoding)
+
+    assert response.headers.get("content-encoding") == expected
+    suffix = {"br": ".br", "gzip": ".gz", None: ""}[expected]
+    assert response.path.endswith("app.abc.js" + suffix)
+    assert response.headers["cache-control"] == assets.IMMUTABLE_CACHE_CONTROL
+
+
+def test_asset_response_skips_missing_variant(dist):
+    response = assets.asset_response("only-gz.abc.css", "br, gzip;q=0.1")
+
+    assert response.headers.get("content-encoding") == "gzip"
+
+
+@pytest.mark.parametrize("path", ["../secret.txt", "app.abc.js.gz", "missing.js"])
+def test_asset_response_rejects_unservable_paths(dist, path):
+    with pytest.raises(HTTPException) as exc:
+        assets.asset_response(path, "gzip")
+    assert exc.value.status_code == 404
@@ -0,0 +1,75 @@
+from app import crud, history
+from app.crud import Node, ConfigState
+
+
+def _records(records):
+    return {r["id"]: r for r in records}
+
+
+def _new_project(db):
+    project = crud.create_project(db, "Test Vehicle", ConfigState())
+    tree = Node(id="root", name="PROJECT", level=0, children=[
+        Node(id="sys1", name="1.0 Powertrain", level=1, children=[
+            Node(id="p11", name="Block", level=2, own_cost=100, material="Cast Iron"),
+            Node(id="p12", name="Head", level=2, own_cost=50, material="Aluminum 6061"),
+        ]),
+        Node(id="sys2", name="2.0 Body", level=1, children=[
+            Node(id="p21", name="Door", level=2, own_cost=20),
+        ]),
+    ])
+    crud.save_tree_to_db(db, tree, project.pk)
+    return project
+
+
+def test_reconstruct_matches_live_tree_across_snapshots(db, monkeypatch):
+    monkeypatch.setattr(history, "SNAPSHOT_INTERVAL", 4)
+    project = _new_project(db)
+    expected = {history.current_revision(db, project.pk): history.flatten_project(db, project.pk)}
+
+    def write(action):
+        action()
+        rev = history.current_revision(db, project.pk)
+        assert rev not in expected
+        expected[rev] = history.flatten_project(db, project.pk)
+
+    sys1 = crud.get_node(db, "sys1")
+    write(lambda: crud.update_node(db, "p11", {"own_cost": 120, "quantity": 2}))
+    write(lambda: crud.create_node(db, Node(id="p13", name="Gasket", level=2, own_cost=5), project.pk, sys1.pk))
+    write(lambda: crud.update_node(db, "p13", {"material": "Composite"}))
+    write(lambda: crud.delete_node(db, "sys2"))
+    write(lambda: crud.create_node(db, Node(id="p14", name="Sump", level=2), project.pk, sys1.pk))
+    write(lambda: crud.update_node(db, "p12", {"weight": 900.0}))
+    write(lambda: crud.delete_node(db, "p13"))
+    write(lambda: crud.update_node(db, "p14", {"own_cost": 42}))
+    write(lambda: crud.update_node(db, "root", {"own_cost": 1}))
+
+    assert len(expected) == 10
+    snapshot_revs = [rev for rev, in db.query(history.TreeSnapshot.rev).filter(
+        history.TreeSnapshot.project_pk == project.pk)]
+    assert len(snapshot_revs) > 1
+    for rev, records in expected.items():
+        assert _records(history.reconstruct(db, project.pk, rev)) == _records(records), rev
+    assert history.reconstruct(db, project.pk, max(expected) + 1) is None
+
+
+def test_unchanged_update_records_no_revision(db):
+    project = _new_project(db)
+    rev = history.current_revision(db, project.pk)
+
+    crud.update_node(db, "p11", {"own_cost": 100})
+    crud.update_node(db, "p11", {"not_a_field": 1})
+
+    assert history.current_revision(db, project.pk) == rev
+
+
+def test_project_without_snapshot_gets_one_on_next_change(db):
+    project = _new_project(db)
+    # As for projects created before the history tables existed
+    db.query(history.TreeSnapshot).delete()
+    db.query(history.NodeChange).delete()
+    db.commit()
+
+    crud.update_node(db, "p21", {"own_cost": 25})
+
+    records = _records(history.reconstruct(db, project.pk, 1))
+    assert records["p21"]["own_cost"] == 25
@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import inspect
+
+from app import migrations
+
+
+def _create_legacy_tables(engine):
+    # Layout written by the old create_all at import: string keys, no pk column
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE projects (id VARCHAR PRIMARY KEY, name VARCHAR)")
+        conn.exec_driver_sql(
+            "CREATE TABLE nodes (id VARCHAR PRIMARY KEY, project_id VARCHAR, parent_id VARCHAR)"
+        )
+
+
+def test_upgrade_empty_database_to_head(engine):
+    applied = migrations.upgrade(engine)
+
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.check_schema_version(engine) == migrations.head_version()
+    assert migrations.upgrade(engine) == []
+
+
+def test_unversioned_legacy_database_is_not_stamped(engine):
+    _create_legacy_tables(engine)
+
+    with pytest.raises(RuntimeError, match="Legacy schema"):
+        migrations.upgrade(engine)
+    assert not inspect(engine).has_table(migrations.SCHEMA_VERSION_TABLE)
+
+
+def test_stamped_legacy_database_is_reported(engine):
+    _create_legacy_tables(engine)
+    with engine.begin() as conn:
+        migrations.schema_version.create(conn)
+        conn.execute(migrations.schema_version.insert().values(version=4, description="stamped"))
+
+    with engine.connect() as conn, pytest.raises(RuntimeError, match="Legacy schema"):
+        migrations.current_version(conn)
+
+
+def test_startup_check_refuses_unmigrated_database(engine):
+    with pytest.raises(RuntimeError, match="version 0"):
+        migrations.check_schema_version(engine)